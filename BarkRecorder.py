@@ -1,9 +1,14 @@
 """BarkRecorder handles the audio recording."""
+import atexit
 import threading
 import time
 import wave
 
-import pyaudio
+import sounddevice as sd
+
+from RingBuffer import RingBuffer
+from TailLogger import TailLogger
+from ThreadTuning import AUDIO_CPU, pin_current_thread, raise_priority
 
 
 class BarkRecorder:
@@ -14,21 +19,28 @@ class BarkRecorder:
     channels: int
     filename: str
     part_number: int
-    format: int
-    audio_frames: list
-    running: bool
-    listener: pyaudio.PyAudio
+    dtype: str
+    ring: RingBuffer
+    dropped_bytes: int
+    stop_event: threading.Event
+    stop_lock: threading.Lock
     audio_filename: str
-    stream: pyaudio.Stream
+    wave_file: wave.Wave_write
+    part_switch: tuple[int, wave.Wave_write]
+    stream: sd.RawInputStream
     audio_thread: threading.Thread
+    writer_thread: threading.Thread
     start_event: threading.Event
-    start_time: float
+    capture_done: threading.Event
+    log: TailLogger
+    start_time_ns: int
+    first_buffer_time_ns: int
 
     def __init__(
         self,
         start_event: threading.Event,
         rate: int,
-        frames_per_buffer: int = 1024,
+        frames_per_buffer: int | None = None,
         channels: int = 1,
         audio_file: str = "audio",
     ) -> None:
@@ -37,93 +49,187 @@ class BarkRecorder:
         Args:
             start_event (threading.Event): Event to wait upon before starting.
             rate (int): Frame rate to use when recording.
-            frames_per_buffer (int, optional): Frames to consider in a buffer. Defaults to 1024.
+            frames_per_buffer (int, optional): Frames to consider in a buffer. Defaults to the
+                device's low input latency period, rounded up to a power of two.
             channels (int, optional): Audio channels to record. Defaults to 1.
             audio_file (str, optional): Name of the resulting file. Defaults to "audio".
 
         """
-        # Rate of device: int(self.listener.get_default_input_device_info()["defaultSampleRate"])
+        # Rate of device: int(sd.query_devices(kind="input")["default_samplerate"])
         self.rate = rate
         self.frames_per_buffer = frames_per_buffer
         self.channels = channels
         self.filename = audio_file
         self.part_number = 1
-        self.format = pyaudio.paInt16
-        self.audio_frames = []
-        self.running = False
+        self.dtype = "int16"
+
+        # Hand-off between the callback and the file writer: ~2 seconds of 16-bit samples
+        self.ring = RingBuffer(self.rate * 2 * self.channels * 2)
+        self.dropped_bytes = 0
+        self.stop_event = threading.Event()
+        self.stop_lock = threading.Lock()  # taken by the first stop() for good
         self.audio_thread = None
+        self.writer_thread = None
         self.start_event = start_event
-        self.start_time = None
-        self.first_buffer_time = None
-
-        self.listener = pyaudio.PyAudio()
-        print(
-            f"device rate: {int(self.listener.get_default_input_device_info()['defaultSampleRate'])}"
-        )
-        self.audio_filename = f"{self.filename}_{self.part_number}.wav"
-        self.stream = self.listener.open(
-            format=self.format,
+        self.capture_done = threading.Event()
+        self.log = TailLogger()  # printing from the PortAudio thread could stall it
+        self.start_time_ns = None  # monotonic clock, to compute delays
+        self.first_buffer_time_ns = None
+
+        device_info = sd.query_devices(kind="input")
+        print(f"device rate: {int(device_info['default_samplerate'])}")
+        if self.frames_per_buffer is None:
+            # One callback per hardware period, so PortAudio does not have to repack buffers
+            period = int(device_info.get("default_low_input_latency", 0.01) * self.rate)
+            self.frames_per_buffer = 1 << max(5, (period - 1).bit_length())
+        print(f"frames per buffer: {self.frames_per_buffer}")
+
+        # Raw stream: the callback gets PortAudio's own buffer, no bytes object per call
+        self.stream = sd.RawInputStream(
+            samplerate=self.rate,
+            blocksize=self.frames_per_buffer,
+            dtype=self.dtype,
             channels=self.channels,
-            rate=self.rate,
-            input=True,
-            frames_per_buffer=self.frames_per_buffer,
-            stream_callback=self.record,
+            callback=self.record,
         )
+        self.wave_file = self.open_wave_file()
+        self.part_switch = None  # (ring position, next file) when a new part is requested
+
+        # Finalize the files even if the program exits without stopping the recording
+        atexit.register(self.stop)
+
+    def open_wave_file(self) -> wave.Wave_write:
+        """Open the file for the current part.
+
+        Returns:
+            wave.Wave_write: File ready to receive the recorded frames.
+
+        """
+        self.audio_filename = f"{self.filename}_{self.part_number}.wav"
+        wave_file = wave.open(self.audio_filename, "wb")  # noqa: SIM115
+        wave_file.setnchannels(self.channels)
+        wave_file.setsampwidth(self.stream.samplesize)
+        wave_file.setframerate(self.rate)
+        return wave_file
 
     def start(self) -> None:
         """Start the object functionalities."""
-        self.running = True
+        self.stop_event.clear()
+        self.log.start()
         self.audio_thread = threading.Thread(target=self.standalone_thread)
+        self.audio_thread.daemon = True
         self.audio_thread.start()
+        self.writer_thread = threading.Thread(target=self.write_file)
+        self.writer_thread.daemon = True  # stop() drains it, even when called at exit
+        self.writer_thread.start()
 
     def standalone_thread(self) -> None:
         """Wait for the start signal and actually start working."""
         self.start_event.wait()
-        self.start_time = time.time()
-        self.stream.start_stream()
+        self.start_time_ns = time.monotonic_ns()
+        self.stream.start()
+
+    def next_part(self) -> None:
+        """Continue the recording in a new file, keeping the stream running.
+
+        Everything captured up to this call goes to the current file, the rest to the new one.
+        Meant to be called at most once per part.
+        """
+        self.part_number += 1
+        next_file = self.open_wave_file()
+        self.part_switch = (self.ring.head, next_file)
 
     def stop(self) -> None:
-        """Stop the object functionalities."""
-        self.running = False
+        """Stop the object functionalities, and release everything exactly once."""
+        # Whoever comes second (e.g. the main thread after Ctrl+C) has nothing left to do
+        if not self.stop_lock.acquire(blocking=False):
+            return
+        self.stop_event.set()
 
         # Stop the stream gracefully.
-        if self.stream.is_active():
-            self.stream.stop_stream()
+        if self.stream.active:
+            self.stream.stop()
         self.stream.close()
+        self.capture_done.set()
+
+        # Let the writer drain what is left in the ring, then fix up the header
+        if self.writer_thread is not None:
+            self.writer_thread.join()
+        self.wave_file.close()
+        self.log.stop()
+
+        if self.dropped_bytes:
+            print(f"Audio ring overflowed, {self.dropped_bytes} bytes dropped")
+
+    def write_file(self) -> None:
+        """Move audio data from the ring to the file as it arrives."""
+        # Poll about twice per buffer, so the ring never gets close to full
+        poll_interval = self.frames_per_buffer / self.rate / 2
+
+        while True:
+            finished = self.capture_done.is_set()
+            first, second = self.ring.read_regions()
+            part_switch = self.part_switch
+
+            if part_switch is not None:
+                split, next_file = part_switch
+                left = split - self.ring.tail  # bytes still belonging to the current part
+                if left <= len(first) + len(second):
+                    self.write_frames(first[:left], second[: max(0, left - len(first))])
+                    self.wave_file.close()
+                    self.wave_file = next_file
+                    self.part_switch = None
+                    continue
+
+            if not first:
+                if finished:
+                    break
+                self.capture_done.wait(poll_interval)
+                continue
+            self.write_frames(first, second)
+
+    def write_frames(self, first: memoryview, second: memoryview) -> None:
+        """Write data taken from the ring to the current file, then release it.
 
-        sampwidth = self.listener.get_sample_size(self.format)
-        self.listener.terminate()
+        Args:
+            first (memoryview): First region returned by the ring.
+            second (memoryview): Second region returned by the ring, possibly empty.
 
-        with wave.open(self.audio_filename, "wb") as wave_file:
-            wave_file.setnchannels(self.channels)
-            wave_file.setsampwidth(sampwidth)
-            wave_file.setframerate(self.rate)
-            wave_file.writeframes(b"".join(self.audio_frames))
+        """
+        # Raw writes skip the per-call header patching; close() fixes it once
+        self.wave_file.writeframesraw(first)
+        if second:
+            self.wave_file.writeframesraw(second)
+        self.ring.advance(len(first) + len(second))
 
-    def record(self, in_data, frame_count, time_info, status_flags) -> tuple[None, int]:  # noqa: ANN001, ARG002
+    def record(self, in_data, frame_count, time_info, status) -> None:  # noqa: ANN001, ARG002
         """Record audio data.
 
         Args:
-            in_data (bytes): The raw audio data captured by the input device.
+            in_data (cffi.buffer): The raw audio data captured by the input device, in a buffer
+                owned by PortAudio.
             frame_count (int): The number of frames of audio data in this callback.
-            time_info (dict): A dictionary containing timing information for the current callback.
-            status_flags (int): Status flags indicating any stream conditions or errors.
+            time_info (cdata): Timing information for the current callback.
+            status (sd.CallbackFlags): Flags indicating any stream conditions or errors.
 
-        Returns:
-            Tuple[None, int]: A tuple where the first element is None (unused for input streams)
-            and the second element is a flag (either `pyaudio.paContinue` to keep recording or
-            `pyaudio.paComplete` to stop recording), depending on whether the recording is still
-            running.
+        Raises:
+            sd.CallbackStop: To stop the stream once the recording has been stopped.
 
         """
         # Callback: called automatically whenever new audio data is available.
         # It runs in a separate thread.
-        if self.first_buffer_time is None:
-            self.first_buffer_time = time.time()
-            print("Audio first buffer timestamp:", self.first_buffer_time)
-
-        # Store the incoming data
-        self.audio_frames.append(in_data)
-
-        # Continue recording if running, else signal completion.
-        return (None, pyaudio.paContinue) if self.running else (None, pyaudio.paComplete)
+        if self.first_buffer_time_ns is None:
+            self.first_buffer_time_ns = time.monotonic_ns()
+            # Keep this thread on its own CPU, ahead of the other threads
+            pin_current_thread(AUDIO_CPU)
+            raise_priority()
+            self.log.log("Audio first buffer timestamp (ns):", self.first_buffer_time_ns)
+
+        # Hand the incoming data over to the writer thread; never block here
+        stored = self.ring.write(in_data)
+        if stored < len(in_data):
+            self.dropped_bytes += len(in_data) - stored
+
+        # Continue recording unless stopped, else signal completion.
+        if self.stop_event.is_set():
+            raise sd.CallbackStop
@@ -0,0 +1,174 @@
+"""FfmpegWriter hands frames over to an ffmpeg process."""
+import contextlib
+import functools
+import os
+import platform
+import subprocess
+
+# Hardware H.264 encoders worth trying on each platform, in order of preference,
+# with their low-latency options. Each is pinned to a 4:2:0 output: given 4:2:2 input, ffmpeg
+# would otherwise pick a 4:4:4 format (High 4:4:4 profile), which most players cannot decode.
+H264_ENCODERS = {
+    "Linux": (
+        ("h264_v4l2m2m", ["-pix_fmt", "yuv420p"]),  # Raspberry Pi
+        ("h264_nvenc", ["-preset", "p1", "-tune", "ll", "-pix_fmt", "yuv420p"]),
+        ("h264_qsv", ["-preset", "veryfast", "-pix_fmt", "nv12"]),
+    ),
+    "Windows": (
+        ("h264_nvenc", ["-preset", "p1", "-tune", "ll", "-pix_fmt", "yuv420p"]),
+        ("h264_qsv", ["-preset", "veryfast", "-pix_fmt", "nv12"]),
+    ),
+    "Darwin": (("h264_videotoolbox", ["-realtime", "1", "-pix_fmt", "yuv420p"]),),
+}
+# Most buffers a single writev call takes (IOV_MAX on Linux)
+WRITEV_MAX_BUFFERS = 1024
+
+# Used when no hardware encoder works
+SOFTWARE_H264_ENCODER = (
+    "libx264",
+    ["-preset", "ultrafast", "-tune", "zerolatency", "-pix_fmt", "yuv420p"],
+)
+
+
+@functools.cache
+def pick_h264_encoder() -> tuple[str, list[str]]:
+    """Find the best H.264 encoder usable on this machine.
+
+    Each candidate encodes a single blank frame; listed encoders can still lack the hardware.
+
+    Returns:
+        tuple[str, list[str]]: Encoder name and its options.
+
+    """
+    for encoder, options in H264_ENCODERS.get(platform.system(), ()):
+        probe = subprocess.run(
+            [
+                "ffmpeg",
+                "-hide_banner",
+                "-loglevel",
+                "error",
+                "-f",
+                "lavfi",
+                "-i",
+                "color=size=640x480",
+                "-frames:v",
+                "1",
+                "-c:v",
+                encoder,
+                *options,
+                "-f",
+                "null",
+                "-",
+            ],
+            capture_output=True,
+            check=False,
+        )
+        if probe.returncode == 0:
+            return encoder, options
+    return SOFTWARE_H264_ENCODER
+
+
+class FfmpegWriter:
+    """Simple class to write frames through ffmpeg, much like cv2.VideoWriter.
+
+    Frames can be written in batches, with a single system call each. Their buffers are only
+    referenced meanwhile, so `write` and `flush` tell how many of them can be reused.
+    """
+
+    process: subprocess.Popen
+    batch_size: int
+    pending: list[memoryview]
+    pending_frames: int
+
+    def __init__(
+        self,
+        input_args: list[str],
+        output_args: list[str],
+        filename: str,
+        batch_size: int = 1,
+    ) -> None:
+        """Construct an object, launching ffmpeg.
+
+        Args:
+            input_args (list[str]): ffmpeg options describing the frames that will be written.
+            output_args (list[str]): ffmpeg options for the output stream.
+            filename (str): Name of the resulting file.
+            batch_size (int, optional): Frames to gather before writing them all at once.
+                Batches need writev, so it stays at 1 where that is not available (Windows).
+                Defaults to 1.
+
+        """
+        self.batch_size = batch_size if hasattr(os, "writev") else 1
+        self.pending = []
+        self.pending_frames = 0
+        self.process = subprocess.Popen(
+            [
+                "ffmpeg",
+                "-hide_banner",
+                "-loglevel",
+                "warning",
+                *input_args,
+                "-i",
+                "-",  # frames come from stdin
+                *output_args,
+                "-y",  # Overwrite without prompting
+                filename,
+            ],
+            stdin=subprocess.PIPE,
+            start_new_session=True,  # Ctrl+C must not end it before the queued frames are in
+        )
+
+    def write(self, frame: bytes, copies: int = 1) -> int:
+        """Write a frame, or queue it until the batch is complete.
+
+        Args:
+            frame (bytes): Bytes-like frame data, in the format given by the input options.
+                It must not change until written.
+            copies (int, optional): Times the frame is repeated in the stream, e.g. to fill
+                the periods the camera missed. Defaults to 1.
+
+        Returns:
+            int: Number of frames written by this call, whose buffers can be reused.
+
+        """
+        self.pending.extend([memoryview(frame).cast("B")] * copies)
+        self.pending_frames += 1
+        if self.pending_frames < self.batch_size:
+            return 0
+        return self.flush()
+
+    def flush(self) -> int:
+        """Write all the queued frames.
+
+        Returns:
+            int: Number of frames written, whose buffers can be reused.
+
+        """
+        buffers = self.pending
+        count = self.pending_frames
+        # If ffmpeg exited on its own, it already reported why
+        with contextlib.suppress(BrokenPipeError):
+            if self.batch_size == 1:
+                for buffer in buffers:
+                    self.process.stdin.write(buffer)
+            else:
+                # The pipe can take less than everything: go on from where it stopped
+                fd = self.process.stdin.fileno()
+                index = 0
+                while index < len(buffers):
+                    written = os.writev(fd, buffers[index : index + WRITEV_MAX_BUFFERS])
+                    while index < len(buffers) and written >= len(buffers[index]):
+                        written -= len(buffers[index])
+                        index += 1
+                    if written:
+                        buffers[index] = buffers[index][written:]
+        self.pending = []
+        self.pending_frames = 0
+        return count
+
+    def release(self) -> None:
+        """Write the queued frames, close the input and wait for ffmpeg to finalize the file."""
+        self.flush()
+        with contextlib.suppress(BrokenPipeError):
+            self.process.stdin.close()
+        self.process.wait()
@@ -1,7 +1,12 @@
 """The KennelRig file is the core of the application."""
+import argparse
+import os
+import shutil
 import signal
 import subprocess
 import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import cv2
 
@@ -18,9 +23,16 @@ class KennelRig:
     audio_filename: str
     parts: int
     start_event: threading.Event
+    verbose: bool
+    ffmpeg_command: list[str]
 
     def __init__(
-        self, video_file: str = "video", audio_file: str = "audio", filename: str = "recording",
+        self,
+        video_file: str = "video",
+        audio_file: str = "audio",
+        filename: str = "recording",
+        verbose: bool = False,  # noqa: FBT001, FBT002
+        no_display: bool = False,  # noqa: FBT001, FBT002
     ) -> None:
         """Construct an object.
 
@@ -28,15 +40,27 @@ class KennelRig:
             video_file (str, optional): Video file name. Defaults to "video".
             audio_file (str, optional): Audio file name. Defaults to "audio".
             filename (str, optional): Name for the final merged video. Defaults to "recording".
+            verbose (bool, optional): Print the ffmpeg commands being run. Defaults to False.
+            no_display (bool, optional): Record without any preview window. Defaults to False.
 
         """
         self.video_filename = video_file
         self.audio_filename = audio_file
         self.filename = filename
         self.parts = 1
+        self.verbose = verbose
+        # Common start of every merge command
+        self.ffmpeg_command = ["ffmpeg", "-hide_banner", "-loglevel", "warning", "-y"]
         self.start_event = threading.Event()
-        self.camera = WiggleChecker(start_event=self.start_event)
-        self.mic = BarkRecorder(start_event=self.start_event, rate=16000)
+        self.camera = WiggleChecker(
+            start_event=self.start_event,
+            video_file=self.video_filename,
+            no_display=no_display,
+            on_new_part=self.new_part,
+        )
+        self.mic = BarkRecorder(
+            start_event=self.start_event, rate=16000, audio_file=self.audio_filename,
+        )
         self.shutdown_initiated = False
 
         # Register signal handler
@@ -53,8 +77,14 @@ class KennelRig:
         cv2.destroyAllWindows()
         self.mic.stop()
         self.camera.stop()
+        # Video parts actually written: a part that failed to open is not counted
+        self.parts = self.camera.part_number
         self.merge()  # TODO: only if not ctrl+c?
 
+    def new_part(self) -> None:
+        """Split the audio along with the video, which just started a new part."""
+        self.mic.next_part()
+
     def signal_handler(self, sig, frame) -> None:  # noqa: ANN001, ARG002
         """Handle the SIGINT signal.
 
@@ -72,64 +102,76 @@ class KennelRig:
             self.mic.stop()
 
     def merge(self) -> None:
-        """Merge audio and video parts in a single file."""
-        # Calculate the relative delays if available.
-        video_delay = (
-            self.camera.first_frame_time - self.camera.start_time
-            if self.camera.first_frame_time
-            else 0.0
+        """Merge audio and video parts in a single file.
+
+        Both streams are copied as they are (no decoding nor encoding), so this is a remux pass.
+        """
+        # No audio was captured: there is nothing to merge, just give the videos their final name
+        if self.mic.first_buffer_time_ns is None:
+            for i in range(1, self.parts + 1):
+                video_file = f"{self.video_filename}_{i}{self.camera.extension}"
+                output_file = f"{self.filename}_{i}{self.camera.extension}"
+                print(f"No audio recorded, moving {video_file} to {output_file}")
+                shutil.move(video_file, output_file)
+            return
+
+        # Calculate the relative delays if available, in integer nanoseconds.
+        video_delay_ns = (
+            self.camera.first_frame_time_ns - self.camera.start_time_ns
+            if self.camera.first_frame_time_ns
+            else 0
         )
-        audio_delay = (
-            self.mic.first_buffer_time - self.mic.start_time if self.mic.first_buffer_time else 0.0
+        audio_delay_ns = (
+            self.mic.first_buffer_time_ns - self.mic.start_time_ns
+            if self.mic.first_buffer_time_ns
+            else 0
         )
 
         # Compute the offset difference: positive if audio starts later than video.
-        offset_diff = audio_delay - video_delay
-        print("Calculated video delay:", video_delay)
-        print("Calculated audio delay:", audio_delay)
+        offset_diff = (audio_delay_ns - video_delay_ns) / 1e9
+        print("Calculated video delay (ns):", video_delay_ns)
+        print("Calculated audio delay (ns):", audio_delay_ns)
         print("Calculated offset (audio - video):", offset_diff)
 
+        # Delay whichever stream started later; this only shifts timestamps, no resampling.
+        video_offset = max(-offset_diff, 0.0)
+        audio_offset = max(offset_diff, 0.0)
+
         # Merge audio and video files
+        commands = []
         for i in range(1, self.parts + 1):
-            video_file = f"{self.video_filename}_{i}.avi"
+            video_file = f"{self.video_filename}_{i}{self.camera.extension}"
             audio_file = f"{self.audio_filename}_{i}.wav"
-            output_file = f"{self.filename}_{i}.avi"
-            # If audio is delayed, apply an offset.
-            if offset_diff > 0:
-                command = [
-                    "ffmpeg",
-                    "-i",
-                    video_file,
-                    "-itsoffset",
-                    str(offset_diff),
-                    "-i",
-                    audio_file,
-                    "-c:a",
-                    "aac",
-                    "-async",
-                    "1",
-                    "-ss",
-                    "-1",  # CHECK: might not always be enough delay
-                    "-y",  # Overwrite without prompting
-                    output_file,
-                ]
-            else:
-                command = [
-                    "ffmpeg",
-                    "-i",
-                    video_file,
-                    "-i",
-                    audio_file,
-                    "-c:a",
-                    "aac",
-                    "-async",
-                    "10",
-                    "-y",
-                    output_file,
-                ]
-            print("Running ffmpeg command:", " ".join(command))
-            subprocess.call(command)
+            output_file = f"{self.filename}_{i}{self.camera.extension}"
+            # Later parts are split at the same instant on both streams: only the first is shifted
+            command = [
+                *self.ffmpeg_command,
+                "-itsoffset",
+                str(video_offset if i == 1 else 0.0),
+                "-i",
+                video_file,
+                "-itsoffset",
+                str(audio_offset if i == 1 else 0.0),
+                "-i",
+                audio_file,
+                "-c",
+                "copy",  # video already encoded while recording, PCM audio fits the container
+                output_file,
+            ]
+            if self.verbose:
+                print("Running ffmpeg command:", " ".join(command))
+            commands.append(command)
+
+        # Parts are independent: run several ffmpeg at once. Our descriptors are not
+        # inheritable anyway, so there is no need to have the child close them all.
+        run = partial(subprocess.run, check=True, close_fds=False)
+        with ThreadPoolExecutor(max_workers=max(1, (os.cpu_count() or 1) // 2)) as executor:
+            list(executor.map(run, commands))
 
 
 if __name__ == "__main__":
-    KennelRig().start()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--no-display", action="store_true", help="record without preview")
+    parser.add_argument("--verbose", action="store_true", help="print the ffmpeg commands")
+    args = parser.parse_args()
+    KennelRig(verbose=args.verbose, no_display=args.no_display).start()
@@ -0,0 +1,79 @@
+"""RingBuffer hands raw bytes over from a producer thread to a consumer thread."""
+
+
+class RingBuffer:
+    """Single-producer/single-consumer byte ring buffer.
+
+    The producer only ever moves `head` and the consumer only ever moves `tail`, so neither side
+    needs a lock: under the GIL each counter update is atomic, and a side can only observe the
+    other's counter lagging behind, never ahead of the data.
+    """
+
+    size: int
+    mask: int
+    view: memoryview
+    head: int
+    tail: int
+
+    def __init__(self, capacity: int) -> None:
+        """Construct an empty buffer.
+
+        Args:
+            capacity (int): Minimum number of bytes to hold; rounded up to a power of two.
+
+        """
+        self.size = 1 << max(0, capacity - 1).bit_length()
+        self.mask = self.size - 1
+        self.view = memoryview(bytearray(self.size))
+        self.head = 0  # total bytes written, only moved by the producer
+        self.tail = 0  # total bytes read, only moved by the consumer
+
+    def available(self) -> int:
+        """Bytes ready to be read.
+
+        Returns:
+            int: Number of bytes written but not yet consumed.
+
+        """
+        return self.head - self.tail
+
+    def write(self, data: bytes) -> int:
+        """Copy data in, as much as it fits (producer side).
+
+        Args:
+            data (bytes): Bytes-like object to store.
+
+        Returns:
+            int: Number of bytes actually stored; the rest is dropped.
+
+        """
+        data = memoryview(data).cast("B")
+        count = min(len(data), self.size - (self.head - self.tail))
+        start = self.head & self.mask
+        first = min(count, self.size - start)
+        self.view[start : start + first] = data[:first]
+        self.view[: count - first] = data[first:count]
+        self.head += count
+        return count
+
+    def read_regions(self) -> tuple[memoryview, memoryview]:
+        """Expose the readable data without copying it (consumer side).
+
+        Returns:
+            tuple[memoryview, memoryview]: The readable bytes, split in two views when they wrap
+            around the end of the buffer. Call `advance` once they have been consumed.
+
+        """
+        count = self.head - self.tail
+        start = self.tail & self.mask
+        first = min(count, self.size - start)
+        return self.view[start : start + first], self.view[: count - first]
+
+    def advance(self, count: int) -> None:
+        """Release bytes obtained through `read_regions` (consumer side).
+
+        Args:
+            count (int): Number of bytes consumed.
+
+        """
+        self.tail += count
@@ -0,0 +1,60 @@
+"""TailLogger keeps console output away from time-critical threads."""
+import collections
+import threading
+
+
+class TailLogger:
+    """Simple class to queue messages and print them from a background thread."""
+
+    entries: collections.deque
+    interval: float
+    stop_event: threading.Event
+    thread: threading.Thread
+
+    def __init__(self, interval: float = 1.0, max_entries: int = 256) -> None:
+        """Construct a default object.
+
+        Args:
+            interval (float, optional): Seconds between two prints of the queued messages.
+                Defaults to 1.0.
+            max_entries (int, optional): Messages kept before the oldest get discarded.
+                Defaults to 256.
+
+        """
+        self.entries = collections.deque(maxlen=max_entries)
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def log(self, *args: object) -> None:
+        """Queue a message; formatting and printing happen later, on the background thread.
+
+        Args:
+            *args (object): Values to print, as they would be passed to `print`.
+
+        """
+        self.entries.append(args)
+
+    def start(self) -> None:
+        """Start printing the queued messages periodically."""
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread and print whatever is left."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+
+    def run(self) -> None:
+        """Print the queued messages until stopped."""
+        while not self.stop_event.wait(self.interval):
+            self.flush()
+
+    def flush(self) -> None:
+        """Print all the queued messages."""
+        while self.entries:
+            print(*self.entries.popleft())
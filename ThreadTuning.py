@@ -0,0 +1,60 @@
+"""ThreadTuning places time-critical threads on the CPUs."""
+import contextlib
+import os
+
+# CPUs available to the process, read before any thread gets pinned (threads inherit affinity)
+CPUS = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+
+# Which of the CPUs above each thread goes to; the first one is left to the main thread
+AUDIO_CPU = 1
+CAPTURE_CPU = 2
+ENCODE_CPU = 3
+
+
+def pin_current_thread(cpu_index: int) -> None:
+    """Bind the calling thread to a single CPU, where supported (Linux).
+
+    Args:
+        cpu_index (int): Index in the available CPUs; wraps around on machines with fewer.
+
+    """
+    if CPUS:
+        os.sched_setaffinity(0, {CPUS[cpu_index % len(CPUS)]})
+
+
+def unpin_current_thread() -> None:
+    """Let the calling thread run on any of the available CPUs again, where supported (Linux).
+
+    Threads and processes started from a pinned thread inherit its CPU: this avoids that.
+    """
+    if CPUS:
+        os.sched_setaffinity(0, CPUS)
+
+
+def raise_priority(priority: int = 10) -> None:
+    """Give the calling thread real-time scheduling, or at least a lower nice value.
+
+    Both need privileges (e.g. CAP_SYS_NICE or an rtprio limit); without them, nothing changes.
+
+    Args:
+        priority (int, optional): SCHED_FIFO priority. Defaults to 10.
+
+    """
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+    except (AttributeError, OSError):
+        lower_niceness()
+
+
+def lower_niceness(increment: int = -5) -> None:
+    """Make the calling thread less nice, so other programs preempt it less often.
+
+    On Linux this only affects the calling thread. Going below 0 needs privileges (e.g.
+    CAP_SYS_NICE or a nice limit); without them, nothing changes.
+
+    Args:
+        increment (int, optional): Change to the nice value. Defaults to -5.
+
+    """
+    with contextlib.suppress(AttributeError, OSError):
+        os.nice(increment)
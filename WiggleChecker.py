@@ -1,16 +1,45 @@
 """WiggleChecker handles the video recording."""
+import atexit
+import platform
 import sys
 import threading
 import time
+from array import array
+from collections.abc import Callable
+from datetime import datetime
 
 import cv2
+import numpy as np
+
+from FfmpegWriter import FfmpegWriter, pick_h264_encoder
+from TailLogger import TailLogger
+from ThreadTuning import (
+    CAPTURE_CPU,
+    ENCODE_CPU,
+    lower_niceness,
+    pin_current_thread,
+    unpin_current_thread,
+)
+
+FRAME_RING_SIZE = 12  # frames buffered between capture and encoding
+FRAME_WRITE_BATCH = 4  # frames handed to ffmpeg at once; their slots stay taken until then
+MAX_STALE_GRABS = 4  # most frames skipped from the driver's buffer before taking one anyway
+GUI_POLL_INTERVAL = 0.1  # longest wait between two GUI event pumps, in seconds
+STATS_INTERVAL = 5.0  # seconds between two logs of the recording statistics
+
+# Native capture backends, by platform: they take the format hints below directly, without an
+# extra pipeline in between (e.g. GStreamer on Linux); others let OpenCV choose
+CAPTURE_BACKENDS = {
+    "Linux": cv2.CAP_V4L2,
+    "Windows": cv2.CAP_MSMF,
+    "Darwin": cv2.CAP_AVFOUNDATION,
+}
 
 
 class WiggleChecker:
     """Simple class to create a capturing video application."""
 
     camera: cv2.VideoCapture
-    running: bool
     frame_width: int
     frame_height: int
     fps: float
@@ -18,9 +47,42 @@ class WiggleChecker:
     part_number: int
     filename: str
     fourcc: int
-    writer: cv2.VideoWriter
-    start_time: float
+    passthrough: bool
+    pixel_format: str
+    extension: str
+    writer: FfmpegWriter
+    next_writer: FfmpegWriter
+    part_switch: tuple[int, threading.Event]
+    closing_threads: list[threading.Thread]
+    on_new_part: Callable[[], None]
+    start_time_ns: int
+    first_frame_time_ns: int
     stop_event: threading.Event
+    stop_lock: threading.Lock
+    frame_ready: threading.Event
+    frames: list[np.ndarray]
+    preview_frames: list[np.ndarray]
+    preview_sequence: array
+    free_slots: threading.Semaphore
+    filled_slots: threading.Semaphore
+    captured_frames: int
+    written_frames: int
+    capture_finished: bool
+    show_preview: bool
+    window_name: str
+    preview_stride: int
+    writer_thread: threading.Thread
+    dropped_frames: int
+    skipped_frames: int
+    repeated_frames: int
+    frame_copies: list[int]
+    ring_high_water: int
+    period_ns: int
+    next_deadline_ns: int
+    next_part_ns: int
+    preview_countdown: int
+    write_latency_ns: float
+    log: TailLogger
 
     def __init__(
         self,
@@ -30,6 +92,9 @@ class WiggleChecker:
         duration_min: int = 30,
         fps: float = 20.0,
         video_file: str = "video",
+        display_fps: float = 5.0,
+        no_display: bool = False,  # noqa: FBT001, FBT002
+        on_new_part: Callable[[], None] | None = None,
     ) -> None:
         """Construct a default object.
 
@@ -40,102 +105,555 @@ class WiggleChecker:
             duration_min (int, optional): Duration of portions to record in minutes. Defaults to 30.
             fps (float, optional): Frame4s per seconds of the recording. Defaults to 20.0.
             video_file (str, optional): Name of the resulting file. Defaults to "video".
+            display_fps (float, optional): Frames per second shown in the preview, which does
+                not need all of them. Defaults to 5.0.
+            no_display (bool, optional): Record without any preview window. Defaults to False.
+            on_new_part (Callable[[], None], optional): Called from the capture thread when a new
+                portion starts, e.g. to split the audio at the same moment. Defaults to None.
 
         """
-        self.running = False
         self.frame_width = width
         self.frame_height = height
         self.fps = fps
         self.max_duration = duration_min * 60  # 30 minutes in seconds
         self.part_number = 1
+        self.on_new_part = on_new_part
         self.filename = video_file
         self.start_event = start_event
-        self.start_time = None
-        self.stop_event = threading.Event()
-        self.current_frame = None  # to share the latest frame with the main thread
-
-        # 4-byte code used to specify the video codec
+        self.start_time_ns = None  # monotonic clock, to compute delays
+        self.first_frame_time_ns = None
+        self.stop_event = threading.Event()  # the only stop flag, for every thread
+        self.stop_lock = threading.Lock()  # taken by the first stop() for good
+        self.frame_ready = threading.Event()  # set whenever a new frame is available
+        self.log = TailLogger()  # keeps prints out of the capture loop
+
+        self.show_preview = not no_display
+        self.window_name = "Video Capture"
+
+        # Ring of captured frames waiting to be encoded: capture fills free slots in order,
+        # the writer empties filled ones in the same order
+        self.free_slots = threading.Semaphore(FRAME_RING_SIZE)
+        self.filled_slots = threading.Semaphore(0)
+        self.captured_frames = 0
+        self.written_frames = 0
+        self.capture_finished = False
+        self.writer_thread = None
+        self.dropped_frames = 0
+        self.skipped_frames = 0
+        self.repeated_frames = 0
+        self.ring_high_water = 0  # most frames waiting in the ring since the last stats log
+        self.write_latency_ns = 0.0  # moving average of the time to hand a frame to ffmpeg
+
+        # 4-byte code used to specify the capture format
         self.fourcc = cv2.VideoWriter_fourcc(*"MJPG")  #  TODO: different if windows?
-
+        self.extension = None
+
+        # Video capturing channel, in the best format the camera offers; sizes below follow it
+        self.open_camera()
+        self.preview_stride = max(1, round(self.fps / display_fps))  # captured frames per preview
+
+        # Slots of the ring, decoded into in place. JPEG data changes size every frame,
+        # so in that case OpenCV allocates it and the slot only keeps a reference.
+        channels = 2 if self.pixel_format == "yuyv422" else 3
+        self.frames = [
+            None
+            if self.passthrough
+            else np.empty((self.frame_height, self.frame_width, channels), dtype=np.uint8)
+            for _ in range(FRAME_RING_SIZE)
+        ]
+        # Times each slot is written: more than once to fill the periods left without a frame
+        self.frame_copies = [1] * FRAME_RING_SIZE
+
+        # Copies of the latest frames to show, shared with the main thread through a seqlock:
+        # the counter is odd while a copy is written, and each new copy goes to the other buffer
+        self.preview_sequence = array("L", [0])
+        self.preview_frames = [
+            None if self.passthrough else np.empty_like(self.frames[0]) for _ in range(2)
+        ]
+
+        # Writer to file, and the next one while switching to a new part
+        self.writer = self.open_writer()
+        self.next_writer = None
+        self.part_switch = None  # (first frame of the new part, next writer ready)
+        self.closing_threads = []
+
+        # Finalize the files even if the program exits without stopping the recording
+        atexit.register(self.stop)
+
+    def open_camera(self) -> None:
+        """Open the camera and settle the capture format, size and rate.
+
+        MJPG is kept as is when the camera delivers it, otherwise raw YUYV or, failing that, BGR.
+        """
         # Video capturing channel
-        self.camera = cv2.VideoCapture(0)  # Camera#0 aka first default camera
+        self.camera = cv2.VideoCapture(  # Camera#0 aka first default camera
+            0, CAPTURE_BACKENDS.get(platform.system(), cv2.CAP_ANY),
+        )
         if not self.camera.isOpened():
             print("Error: Could not open camera")
             sys.exit(1)
 
-        # Writer to file
-        self.writer = cv2.VideoWriter(
-            filename=f"{self.filename}_{self.part_number}.avi",
-            fourcc=self.fourcc,
-            fps=self.fps,
-            frameSize=(self.frame_width, self.frame_height),
-            isColor=True,
+        # Only keep the freshest frame in the driver, instead of a queue of stale ones
+        self.camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        # Ask for MJPG at the target size and rate: compressed by the camera itself, it takes
+        # far less USB bandwidth than the default raw YUYV
+        self.camera.set(cv2.CAP_PROP_FOURCC, self.fourcc)
+        self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.frame_width)
+        self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.frame_height)
+        self.camera.set(cv2.CAP_PROP_FPS, self.fps)
+
+        # If the camera does deliver MJPG, keep its JPEG data as is: frames are then stored
+        # without being decoded and encoded again, and only the preview decodes them. Where the
+        # backend cannot hand JPEG data over, MJPG stays anyway, decoded to BGR by OpenCV.
+        mjpg = int(self.camera.get(cv2.CAP_PROP_FOURCC)) == self.fourcc
+        self.passthrough = mjpg and bool(self.camera.set(cv2.CAP_PROP_CONVERT_RGB, 0))
+
+        # Without MJPG, take the camera's native YUYV as is, and let the encoder convert it:
+        # OpenCV's conversion to BGR would only be undone by the encoder
+        self.pixel_format = "bgr24"
+        if not mjpg:
+            yuyv = cv2.VideoWriter_fourcc(*"YUYV")
+            self.camera.set(cv2.CAP_PROP_FOURCC, yuyv)
+            if int(self.camera.get(cv2.CAP_PROP_FOURCC)) == yuyv and self.camera.set(
+                cv2.CAP_PROP_CONVERT_RGB, 0,
+            ):
+                self.pixel_format = "yuyv422"
+
+        # The driver picks its closest mode to the request: size everything after what it
+        # actually delivers, so frames and encoder settings match
+        width = int(self.camera.get(cv2.CAP_PROP_FRAME_WIDTH)) or self.frame_width
+        height = int(self.camera.get(cv2.CAP_PROP_FRAME_HEIGHT)) or self.frame_height
+        fps = self.camera.get(cv2.CAP_PROP_FPS) or self.fps
+        if (width, height, fps) != (self.frame_width, self.frame_height, self.fps):
+            print(f"Camera delivers {width}x{height} at {fps} fps")
+            self.frame_width, self.frame_height, self.fps = width, height, fps
+
+    def open_writer(self) -> FfmpegWriter:
+        """Open the writer for the current part.
+
+        JPEG frames are muxed as they are; otherwise raw frames are encoded to H.264, in hardware
+        when possible.
+
+        Returns:
+            FfmpegWriter: Writer ready to receive captured frames.
+
+        """
+        if self.passthrough:
+            print("Video encoder: none (MJPG from the camera)")
+            self.extension = ".avi"
+            return FfmpegWriter(
+                ["-f", "mjpeg", "-framerate", str(self.fps)],
+                ["-c:v", "copy"],
+                f"{self.filename}_{self.part_number}{self.extension}",
+                batch_size=FRAME_WRITE_BATCH,
+            )
+
+        encoder, options = pick_h264_encoder()
+        print(f"Video encoder: {encoder}")
+        self.extension = ".mkv"
+        return FfmpegWriter(
+            [
+                "-f",
+                "rawvideo",
+                "-pix_fmt",
+                self.pixel_format,
+                "-s",
+                f"{self.frame_width}x{self.frame_height}",
+                "-r",
+                str(self.fps),
+            ],
+            ["-c:v", encoder, *options, "-b:v", "5M"],
+            f"{self.filename}_{self.part_number}{self.extension}",
+            batch_size=FRAME_WRITE_BATCH,
         )
 
     def start(self) -> None:
         """Launch the video recording function using a thread."""
-        self.running = True
         self.stop_event.clear()
+        self.log.start()
         video_thread = threading.Thread(target=self.record)
         video_thread.daemon = True
         video_thread.start()
+        self.writer_thread = threading.Thread(target=self.write_frames)
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+        stats_thread = threading.Thread(target=self.log_stats)
+        stats_thread.daemon = True
+        stats_thread.start()
 
     def signal_stop(self) -> None:
         """Respond to the stop signal."""
-        self.running = False
         self.stop_event.set()
 
     def stop(self) -> None:
-        """Stop the object functionalities."""
+        """Stop the object functionalities, and release everything exactly once."""
+        # Whoever comes second (e.g. the exit handler) has nothing left to do
+        if not self.stop_lock.acquire(blocking=False):
+            return
+        self.signal_stop()
+
+        # Wait for the buffered frames to be encoded; this also means capture is over
+        if self.writer_thread is not None:
+            self.writer_thread.join()
+        self.log.stop()
+        if self.dropped_frames:
+            print(f"Video encoding lagged behind, {self.dropped_frames} frames dropped")
+        if self.skipped_frames:
+            print(f"Camera faster than {self.fps} fps, {self.skipped_frames} frames skipped")
+        if self.repeated_frames:
+            print(f"Camera or encoding behind, {self.repeated_frames} frames repeated")
+
         # When everything done, release the capture
         if self.camera.isOpened():
             self.camera.release()
+        self.written_frames += self.writer.flush()
         self.writer.release()
+        for thread in self.closing_threads:
+            thread.join()
 
     def display(self) -> None:
-        """Run the display loop on the main thread."""
-        while self.running:
-            if self.current_frame is not None:
-                cv2.imshow("Video Capture", self.current_frame)
-
-            # Check for 'q' key press
-            if cv2.waitKey(10) == ord("q"):
+        """Run the display loop on the main thread, until the recording stops."""
+        if not self.show_preview:
+            # Headless: nothing to show, just wait for the stop
+            while not self.stop_event.wait(GUI_POLL_INTERVAL):
+                pass
+            return
+
+        # Create the window up front, with OpenGL rendering if OpenCV was built with it:
+        # frames then go to a texture instead of being composited on the CPU
+        try:
+            cv2.namedWindow(self.window_name, cv2.WINDOW_OPENGL | cv2.WINDOW_AUTOSIZE)
+        except cv2.error:
+            cv2.namedWindow(self.window_name, cv2.WINDOW_AUTOSIZE)
+
+        # Local names for everything used in the loop, to skip attribute lookups
+        stop_requested = self.stop_event.is_set
+        wait_frame = self.frame_ready.wait
+        clear_frame = self.frame_ready.clear
+        preview_sequence = self.preview_sequence
+        preview_frames = self.preview_frames
+        shown = None if self.passthrough else np.empty_like(self.preview_frames[0])
+        copyto = np.copyto
+        imshow = cv2.imshow
+        imdecode = cv2.imdecode
+        cvt_color = cv2.cvtColor
+        passthrough = self.passthrough
+        yuyv = self.pixel_format == "yuyv422"
+        window_name = self.window_name
+        wait_key = cv2.waitKey
+        quit_key = ord("q")
+
+        while not stop_requested():
+            # Sleep until a new frame comes in; a new frame wakes the loop right away, so the
+            # timeout only bounds how long GUI events and key presses can wait
+            if wait_frame(timeout=GUI_POLL_INTERVAL):
+                clear_frame()
+                sequence = preview_sequence[0]
+                frame = preview_frames[(sequence >> 1) & 1]  # latest complete copy
+                if passthrough:
+                    frame = imdecode(frame, cv2.IMREAD_COLOR)  # None if the JPEG is corrupt
+                elif yuyv:
+                    frame = cvt_color(frame, cv2.COLOR_YUV2BGR_YUYV)
+                else:
+                    copyto(shown, frame)
+                    frame = shown
+                # Only show it if the capture did not start writing that buffer again meanwhile;
+                # cameras now and then send a truncated JPEG, just wait for the next frame then
+                if frame is not None and preview_sequence[0] <= (sequence | 1) + 1:
+                    imshow(window_name, frame)
+
+            # Check for 'q' key press; also pumps the GUI events
+            if wait_key(1) == quit_key:
                 print("q pressed, stopping...")
                 self.signal_stop()
                 break
 
-            time.sleep(0.01)  # Prevent a tight loop
-
         print("out of while loop")
 
     def record(self) -> None:
         """Record the video."""
-        # Wait until signaled to start
+        self.wait_for_start()
+
+        # Local names for everything used in the loop, to skip attribute lookups
+        stop_requested = self.stop_event.is_set
+        is_opened = self.camera.isOpened
+        grab_latest = self.grab_latest
+        frame_periods = self.frame_periods
+        retrieve = self.camera.retrieve
+        monotonic = time.monotonic_ns
+        take_free_slot = self.free_slots.acquire
+        publish_slot = self.filled_slots.release
+        publish_preview = self.publish_preview
+        frames = self.frames
+        frame_copies = self.frame_copies
+        head = 0
+        gap = 0  # periods without a frame since the last one handed over
+        show_preview = self.show_preview
+
+        # Whatever happens in the loop, the writer and the other threads must learn it is over
+        try:
+            while not stop_requested() and is_opened():
+                grab_latest()
+
+                # Keep to the cadence: a camera faster than the nominal rate gets its extra frames
+                # skipped, and periods missed after a stall are filled by repeating the next frame,
+                # so the file keeps lasting as long as the audio
+                now = monotonic()
+                periods = frame_periods(now)
+                if not periods:
+                    self.skipped_frames += 1
+                    continue
+                gap += periods - 1
+
+                # Never wait for the writer: if encoding lags behind and the ring is full,
+                # drop the frame without even decoding it; the next one fills its period
+                if not take_free_slot(blocking=False):
+                    self.dropped_frames += 1
+                    gap += 1
+                    continue
+
+                # Decode only that frame, straight into the free slot
+                ret, frame = retrieve(frames[head])
+                if not ret:
+                    self.log.log("Error: Could not read frame")
+                    break
+                if self.first_frame_time_ns is None:
+                    self.mark_first_frame()
+
+                # Operations on video here, if needed
+                # TODO: night time
+
+                # Portion over: this frame is the first of a new part, split along with the audio
+                if now >= self.next_part_ns:
+                    self.start_next_part()
+
+                # Hand the frame over to the writer thread
+                frames[head] = frame
+                frame_copies[head] = 1 + gap
+                self.repeated_frames += gap
+                gap = 0
+                head = (head + 1) % FRAME_RING_SIZE
+                self.captured_frames += 1
+                publish_slot()
+                self.ring_high_water = max(
+                    self.ring_high_water, self.captured_frames - self.written_frames,
+                )
+
+                if show_preview:
+                    publish_preview(frame)
+        finally:
+            self.finish_capture()
+
+    def wait_for_start(self) -> None:
+        """Set the capture thread up, then wait until signaled to start."""
+        # Stay on a CPU apart from the audio and the display, ahead of other programs so frames
+        # do not pile up in the driver
+        pin_current_thread(CAPTURE_CPU)
+        lower_niceness()
         self.start_event.wait()
-        self.start_time = time.time()
-        self.first_frame_time = None
-
-        while self.running and self.camera.isOpened():
-            # Capture frame-by-frame
-            ret, frame = self.camera.read()
-            if not ret:
-                print("Error: Could not read frame")
-                break
+        self.start_time_ns = time.monotonic_ns()
+        self.first_frame_time_ns = None
+        self.period_ns = int(1e9 / self.fps)
+        self.next_deadline_ns = None
+        self.next_part_ns = self.start_time_ns + self.max_duration * 1_000_000_000
+        self.preview_countdown = 1
+
+    def finish_capture(self) -> None:
+        """Let the writer and the other threads know the capture is over."""
+        self.log.log("Video recording thread exiting, signaling stop")
+        # Wake the writer one last time, with no frame: it stops once everything is written
+        self.capture_finished = True
+        self.filled_slots.release()
+        self.signal_stop()
 
-            # On first frame, record the timestamp
-            if self.first_frame_time is None:
-                self.first_frame_time = time.time()
-                print("Video first frame timestamp:", self.first_frame_time)
+    def grab_latest(self) -> None:
+        """Grab frames until a grab has to wait for the camera: that frame is the freshest one.
 
-            # Operations on video here, if needed
-            # TODO: night time
+        Stale frames are skipped without ever being decoded.
+        """
+        grab = self.camera.grab
+        clock = time.perf_counter_ns
+        # A grab faster than this came from the driver's buffer, so it is not the latest frame.
+        # Well below a period, so that a camera running faster than nominal still counts as live.
+        live_grab_ns = self.period_ns // 4
+        for _ in range(MAX_STALE_GRABS):
+            grab_start = clock()
+            if not grab() or clock() - grab_start > live_grab_ns:
+                return
+        grab()
+
+    def frame_periods(self, now_ns: int) -> int:
+        """Place a frame on the nominal cadence, one frame per period.
 
-            # Write the frame to the video file
-            self.writer.write(frame)
-            self.current_frame = frame
+        Args:
+            now_ns (int): Monotonic time the frame was grabbed at, in nanoseconds.
 
-        print("Video recording thread exiting, signaling stop")
-        self.signal_stop()
+        Returns:
+            int: Periods the frame stands for: 0 if it came early and should be skipped, 1 if on
+            time, more after a stall (the missed periods are filled with copies of it).
+
+        """
+        if self.next_deadline_ns is None:
+            self.next_deadline_ns = now_ns
+        elif now_ns < self.next_deadline_ns - self.period_ns // 2:
+            return 0
+
+        periods = 1 + max(0, (now_ns - self.next_deadline_ns) // self.period_ns)
+        self.next_deadline_ns += periods * self.period_ns
+        return periods
+
+    def mark_first_frame(self) -> None:
+        """Record the time of the first frame, for the delay against the audio."""
+        self.first_frame_time_ns = time.monotonic_ns()
+        # Wall clock for people reading the log only; delays use the monotonic clock
+        self.log.log(
+            "Video first frame at",
+            datetime.now().astimezone().isoformat(timespec="milliseconds"),
+            "timestamp (ns):",
+            self.first_frame_time_ns,
+        )
+
+    def publish_preview(self, frame: np.ndarray) -> None:
+        """Pass one frame every `preview_stride` on to the preview, which decodes and shows it.
+
+        The copies alternate between two buffers, under a seqlock: the counter is odd while a
+        copy is being written, so the reader can tell whether its buffer changed meanwhile.
+
+        Args:
+            frame (np.ndarray): Captured frame, as stored in the ring.
+
+        """
+        self.preview_countdown -= 1
+        if self.preview_countdown:
+            return
+        self.preview_countdown = self.preview_stride
+
+        preview_sequence = self.preview_sequence
+        sequence = preview_sequence[0] + 1
+        preview_sequence[0] = sequence  # odd: copy in progress
+        buffer = ((sequence >> 1) + 1) & 1
+        if self.passthrough:
+            self.preview_frames[buffer] = frame.copy()  # JPEG size varies
+        else:
+            # Some backends hand raw data over as a single row of bytes
+            target = self.preview_frames[buffer]
+            np.copyto(target, frame.reshape(target.shape))
+        preview_sequence[0] = sequence + 1
+        self.frame_ready.set()
+
+    def start_next_part(self) -> None:
+        """Send the frames captured from now on to a new part, without pausing the capture.
+
+        Called before the current frame is handed over, so that frame starts the new part. The
+        next writer is opened on its own thread; the writer thread switches to it when it
+        reaches that frame.
+        """
+        if self.part_switch is not None:
+            return  # previous switch still pending
+
+        self.next_part_ns += self.max_duration * 1_000_000_000
+        self.part_number += 1
+        writer_ready = threading.Event()
+        self.part_switch = (self.captured_frames, writer_ready)
+        threading.Thread(target=self.prepare_next_writer, args=(writer_ready,), daemon=True).start()
+        if self.on_new_part is not None:
+            self.on_new_part()
+
+    def prepare_next_writer(self, writer_ready: threading.Event) -> None:
+        """Open the writer for the part about to start.
+
+        Args:
+            writer_ready (threading.Event): Set once the writer is available, or could not be
+                opened (then `next_writer` stays None).
+
+        """
+        # Started from the capture thread: do not leave ffmpeg on the capture CPU
+        unpin_current_thread()
+        try:
+            self.next_writer = self.open_writer()
+        except OSError as error:
+            self.log.log("Error: Could not open the next video part:", error)
+        finally:
+            writer_ready.set()  # the writer thread waits for this either way
+
+    def write_frames(self) -> None:
+        """Encode the captured frames to file, until the end of the recording."""
+        # Stay on a CPU of its own, next to the capture, so frames stay in warm caches
+        pin_current_thread(ENCODE_CPU)
+        take_filled_slot = self.filled_slots.acquire
+        release_slot = self.free_slots.release
+        write = self.writer.write
+        clock = time.perf_counter_ns
+        frames = self.frames
+        frame_copies = self.frame_copies
+        slots = len(frames)
+        tail = 0
+        queued = 0  # frames taken from the ring, whether already out to ffmpeg or in a batch
+
+        while True:
+            take_filled_slot()
+
+            part_switch = self.part_switch
+            if part_switch is not None and queued >= part_switch[0]:
+                # First frame of a new part: move to the next writer (frames keep piling up
+                # in the ring meanwhile), and let the old one finalize its file on the side
+                part_switch[1].wait()
+                if self.next_writer is None:
+                    # No new part after all: keep the frames in this one, and end the recording
+                    self.part_number -= 1
+                    self.part_switch = None
+                    self.signal_stop()
+                else:
+                    written = self.writer.flush()  # frames still queued belong to the old part
+                    if written:
+                        self.written_frames += written
+                        release_slot(written)
+                    old_writer, self.writer = self.writer, self.next_writer
+                    write = self.writer.write
+                    self.next_writer = None
+                    self.part_switch = None
+                    closing = threading.Thread(target=old_writer.release, daemon=True)
+                    closing.start()
+                    self.closing_threads.append(closing)
+
+            if queued == self.captured_frames and self.capture_finished:
+                break
+            write_start = clock()
+            written = write(frames[tail], frame_copies[tail])
+            tail = (tail + 1) % slots
+            queued += 1
+            # Slots can only be reused once their frames are actually out; most calls only add
+            # the frame to the batch, so only the calls that wrote something are timed
+            if written:
+                latency_ns = (clock() - write_start) / written
+                self.write_latency_ns = 0.9 * self.write_latency_ns + 0.1 * latency_ns
+                self.written_frames += written
+                release_slot(written)
+
+    def stats(self) -> dict[str, float]:
+        """Gather the recording statistics.
+
+        Returns:
+            dict[str, float]: Frame counters, the ring high-water mark since the last log, and
+            the average time to write a frame, in milliseconds.
+
+        """
+        return {
+            "captured": self.captured_frames,
+            "written": self.written_frames,
+            "dropped": self.dropped_frames,
+            "skipped": self.skipped_frames,
+            "repeated": self.repeated_frames,
+            "ring_high_water": self.ring_high_water,
+            "write_latency_ms": self.write_latency_ns / 1e6,
+        }
+
+    def log_stats(self) -> None:
+        """Log the recording statistics periodically, until the recording stops."""
+        while not self.stop_event.wait(STATS_INTERVAL):
+            self.log.log("Video stats:", self.stats())
+            self.ring_high_water = 0
 
     def get_video_feature(self, prop_id: int) -> any:
         """Getter function for a property.
@@ -159,16 +677,3 @@ class WiggleChecker:
         """
         self.camera.set(prop_id, value)  # prop_id in [0;18]
 
-
-# TODO: divide in parts
-# # Check if 30 minutes have passed
-# if time.time() - start_time >= max_duration:
-#     out.release()
-#     recording = False
-#     audio_thread.join()
-#     part_number += 1
-#     out = cv2.VideoWriter(f'output_part_{part_number}.avi', fourcc, fps, (frame_width, frame_height))
-#     audio_thread = threading.Thread(target=record_audio, args=(f'audio_part_{part_number}.wav',))
-#     recording = True
-#     audio_thread.start()
-#     start_time = time.time()